@@ -0,0 +1,142 @@
+import re
+import string
+import threading
+import numpy as np
+
+from .QAModel import is_answer
+
+
+class CascadeQAModel:
+    """
+    Small model reads all the texts,
+    large model rereads only the best texts when small model is not confident
+
+    Can be used instead of QAModel, predictions are [answer, score, tier]
+    where tier is SMALL or LARGE, the model that gave the answer.
+    Logits of different models are not comparable,
+    so when large model is used only its predictions are returned
+    and WikiQA.best_answer prefers answers of large model
+    """
+    SMALL = 0
+    LARGE = 1
+
+    def __init__(self, small_model, large_model, top_k=2, threshold=5.0):
+        """
+        small_model, large_model: QAModel
+        top_k: how many texts with the best scores are reread by large model
+        threshold: if the best score of small model is lower, ask large model
+        """
+        self.small_model = small_model
+        self.large_model = large_model
+        self.top_k = top_k
+        self.threshold = threshold
+
+        # per model call, see call_escalation_rate
+        self.stats = {"calls": 0, "escalations": 0, "texts": 0, "escalated_texts": 0}
+        self.lock = threading.Lock()  # model can be called from many threads
+
+    def __call__(self, question, texts, key=None):  # predict
+        preds = self.small_model(question, texts, key)
+
+        with self.lock:
+            self.stats["calls"] += 1
+            self.stats["texts"] += len(texts)
+
+        if not preds or self.confident(preds):
+            return [[answer, score, self.SMALL] for answer, score in preds]
+
+        # reread texts with the best answers,
+        # if small model found no answer at all, texts with the best spans
+        candidates = [i for i, (answer, score) in enumerate(preds) if is_answer(answer)]
+        if not candidates:
+            candidates = list(range(len(preds)))
+
+        best = sorted(candidates, key=lambda i: -preds[i][1])[:self.top_k]
+        large_preds = self.large_model(question, [texts[i] for i in best], key)
+
+        with self.lock:
+            self.stats["escalations"] += 1
+            self.stats["escalated_texts"] += len(best)
+
+        return [[answer, score, self.LARGE] for answer, score in large_preds]
+
+    def confident(self, preds):
+        """
+        Spans without answer ([CLS] etc.) have high scores,
+        so only real answers are taken into account
+        """
+        scores = [score for answer, score in preds if is_answer(answer)]
+        return len(scores) > 0 and max(scores) >= self.threshold
+
+    @property
+    def call_escalation_rate(self):
+        """
+        Part of model calls that were reread by large model
+        stats are per call, not per question:
+        WikiQA calls the model for the fast path of every search request
+        and for the slow path when the fast one finds no good answer
+        """
+        if self.stats["calls"] == 0:
+            return 0.0
+
+        return self.stats["escalations"] / self.stats["calls"]
+
+    def reset_stats(self):
+        with self.lock:
+            for i in self.stats:
+                self.stats[i] = 0
+
+    def calibrate(self, eval_set, precision=0.9):
+        """
+        Finds the lowest threshold where small model is right
+        at least in `precision` part of the questions it answers alone
+
+        eval_set: list of (question, texts, answer)
+        Returns new threshold
+        """
+        results = []
+        for question, texts, answer in eval_set:
+            preds = [[predicted, score] for predicted, score in self.small_model(question, texts)
+                     if is_answer(predicted)]
+            if not preds:  # cascade escalates such questions anyway
+                continue
+
+            best_answer, best_score = max(preds, key=lambda x: x[1])
+            results.append([float(best_score), self.same_answer(best_answer, answer)])
+
+        if not results:
+            return self.threshold
+
+        # sort by score in descending order
+        results = sorted(results, key=lambda x: -x[0])
+        scores = np.array([score for score, right in results])
+        right = np.cumsum([right for score, right in results])
+        precisions = right / np.arange(1, len(results) + 1)
+
+        good = np.nonzero(precisions >= precision)[0]
+        if len(good) == 0:  # small model is never good enough
+            self.threshold = np.inf
+        else:
+            self.threshold = scores[good[-1]]
+
+        return self.threshold
+
+    def same_answer(self, predicted, answer):
+        """
+        SQuAD exact match of answer of model and the right one
+        """
+        return self.normalize(predicted) == self.normalize(answer)
+
+    def normalize(self, text):
+        """
+        SQuAD normalization: lower case, no punctuation, articles and extra spaces
+        tokens of the model are joined back into words first
+        """
+        if '▁' in text:  # "▁wo rd" -> "word"
+            text = text.replace(' ', '').replace('▁', ' ')
+        text = text.replace(' ##', '')  # "wo ##rd" -> "word"
+
+        text = text.lower()
+        text = ''.join(i for i in text if i not in string.punctuation)
+        text = re.sub(r'\b(a|an|the)\b', ' ', text)
+        return ' '.join(text.split())
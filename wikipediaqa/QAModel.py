@@ -1,9 +1,105 @@
 from transformers import AutoTokenizer, AutoModelForQuestionAnswering, BigBirdForQuestionAnswering
+from transformers import BatchEncoding
+from collections import OrderedDict
+import threading
+import warnings
 import numpy as np
 
 
+def is_answer(answer):
+    """
+    False for empty answers, special tokens (no answer) and too long spans
+    """
+    return (('[CLS]' not in answer) and
+            ('[SEP]' not in answer) and
+            ('<pad>' not in answer) and
+            ('<unk>' not in answer) and
+            (len(answer) < 200) and
+            (len(answer) > 2) and
+            (answer != ''))
+
+
+class TokenizedParagraphs:
+    """
+    Paragraphs of one page tokenized without special tokens
+    ids of all paragraphs are stored in one flat array,
+    paragraph i is ids[offsets[i] : offsets[i + 1]]
+    """
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.index = {}  # text -> position of paragraph
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, text):
+        return text in self.index
+
+    def add(self, texts, ids):
+        lengths = np.array([len(i) for i in ids], dtype=np.int64)
+        for text in texts:
+            self.index[text] = len(self.index)
+
+        self.ids = np.concatenate([self.ids] + [np.asarray(i, dtype=np.int32) for i in ids])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+
+    def get(self, text):
+        i = self.index[text]
+        return self.ids[self.offsets[i] : self.offsets[i + 1]]
+
+
+class ParagraphCache:
+    """
+    LRU cache of tokenized paragraphs
+    key should identify the page and its revision, e.g. (url, revision)
+    """
+    def __init__(self, tokenizer, max_pages=256):
+        self.tokenizer = tokenizer
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()  # model can be called from many threads
+
+    def __call__(self, key, texts):
+        """
+        Returns ids of texts, tokenizes only paragraphs that are not cached yet
+        """
+        if key is None:  # nothing to cache by
+            return [np.asarray(i, dtype=np.int32) for i in self.encode(texts)]
+
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                page = TokenizedParagraphs()
+                self.pages[key] = page
+                if len(self.pages) > self.max_pages:
+                    self.pages.popitem(last=False)
+            else:
+                self.pages.move_to_end(key)
+
+            missing = list(dict.fromkeys(i for i in texts if i not in page))
+
+        # tokenize without the lock, so other pages are not blocked
+        ids = self.encode(missing) if missing else []
+
+        with self.lock:
+            # another thread might have added some of them meanwhile
+            new = [(text, i) for text, i in zip(missing, ids) if text not in page]
+            if new:
+                page.add([text for text, i in new], [i for text, i in new])
+
+            return [page.get(i) for i in texts]
+
+    def encode(self, texts):
+        return self.tokenizer(texts, add_special_tokens=False)['input_ids']
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+
+
 class QAModel:
-    def __init__(self, model=None, tokenizer=None, batch_size=4, device="cpu"):
+    def __init__(self, model=None, tokenizer=None, batch_size=4, device="cpu", cache_size=256):
         if not model:
             model = "twmkn9/distilbert-base-uncased-squad2"
 
@@ -15,24 +111,39 @@ class QAModel:
 
         self.model = self.model.to(device)
 
-        self.tokenizer = tokenizer
+        self.cache = ParagraphCache(self.tokenizer, cache_size)
         self.batch_size = batch_size
         self.device = device
 
-    def __call__(self, question, texts):  # predict
+        # some tokenizers can't be assembled from ids, they are used as is
+        self.use_cache = self.check_build_inputs()
+        if not self.use_cache:
+            warnings.warn(
+                f"Inputs can't be built from cached ids for {type(self.tokenizer).__name__} "
+                f"({self.tokenizer.name_or_path}), paragraphs will be tokenized on every call",
+                RuntimeWarning)
+
+    def __call__(self, question, texts, key=None):  # predict
+        """
+        key: identifies the page texts come from, e.g. (url, revision)
+        paragraphs of the page are tokenized once and cached by key
+
+        Returns [answer, score] for every text,
+        score is the mean of the best start and end logits
+        """
         # TODO separating by batches doesn't seem to solve the problem with RAM
         # try:
         preds = []
-        for tokens in self.dataLoader(question, texts):
+        for tokens in self.dataLoader(question, texts, key):
             tokens.to(self.device)
 
-            logits = model(**tokens)
+            logits = self.model(**tokens)
 
             starts, ends = logits[0], logits[1]
 
             for i, (start, end) in (enumerate(zip(starts, ends))):
-                start, end = start.argmax(), end.argmax()
-                answer_ids = tokens['input_ids'][i, start : end + 1]
+                start_id, end_id = start.argmax(), end.argmax()
+                answer_ids = tokens['input_ids'][i, start_id : end_id + 1]
                 
                 score = (start.max() + end.max()) / 2
                 score = score.cpu().detach().numpy()
@@ -47,18 +158,109 @@ class QAModel:
         #     print(traceback.format_exc())
         #     return [['Cuda:(', 0]]
 
-    def tokenize(self, question, texts):
+    def tokenize(self, question, texts, key=None):
+        """
+        Same as tokenizer(questions, texts, padding=True, truncation=True)
+        but texts are taken from cache and question is tokenized only once
+        """
+        if not self.use_cache:
+            return self.tokenize_pairs(question, texts)
+
+        if isinstance(question, str):
+            question = self.tokenize_question(question)
+
+        return self.build_inputs(question, self.cache(key, texts))
+
+    def tokenize_pairs(self, question, texts, return_tensors="pt"):
         questions = np.repeat(question, len(texts))
         self.inputs = self.tokenizer(questions.tolist(),
                                      texts,
                                      add_special_tokens=True,
                                      padding=True, truncation=True,
-                                     return_tensors="pt")
-        
+                                     return_tensors=return_tensors)
+
+        return self.inputs
+
+    def tokenize_question(self, question):
+        if not self.use_cache:
+            return question
+
+        return self.tokenizer(question, add_special_tokens=False)['input_ids']
+
+    def check_build_inputs(self):
+        """
+        Checks that build_inputs gives the same output as the tokenizer
+        e.g. PreTrainedTokenizerFast loaded from tokenizer.json
+        does not add special tokens in build_inputs_with_special_tokens
+        """
+        question = "Who wrote the first Harry Potter book?"
+        texts = ["Harry Potter and the Philosopher's Stone was written by J. K. Rowling.",
+                 # longer than 512 tokens to check truncation
+                 "The novel was first published in 1997 by Bloomsbury in London. " * 60]
+
+        try:
+            expected = self.tokenize_pairs(question, texts, return_tensors="np")
+            inputs = self.build_inputs(self.tokenizer(question, add_special_tokens=False)['input_ids'],
+                                       [np.asarray(i) for i in self.cache.encode(texts)])
+        except Exception:
+            return False
+
+        if set(expected.keys()) != set(inputs.keys()):
+            return False
+
+        return all(np.array_equal(expected[i], inputs[i].numpy()) for i in expected)
+
+    def build_inputs(self, question_ids, texts_ids):
+        """
+        Concatenates ids of question and texts with special tokens,
+        truncates them ("longest_first") and pads them
+        """
+        tokenizer = self.tokenizer
+        max_length = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add(pair=True)
+        use_token_types = "token_type_ids" in tokenizer.model_input_names
+
+        input_ids, token_type_ids = [], []
+        for text_ids in texts_ids:
+            q_ids, p_ids = question_ids, text_ids.tolist()
+
+            overflow = len(q_ids) + len(p_ids) - max_length
+            if overflow > 0:
+                q_ids, p_ids, _ = tokenizer.truncate_sequences(
+                    q_ids, pair_ids=p_ids, num_tokens_to_remove=overflow,
+                    truncation_strategy="longest_first")
+
+            input_ids.append(tokenizer.build_inputs_with_special_tokens(q_ids, p_ids))
+            if use_token_types:
+                token_type_ids.append(
+                    tokenizer.create_token_type_ids_from_sequences(q_ids, p_ids))
+
+        length = max(len(i) for i in input_ids)
+        ids = np.full((len(input_ids), length), tokenizer.pad_token_id, dtype=np.int64)
+        types = np.full((len(input_ids), length), tokenizer.pad_token_type_id, dtype=np.int64)
+        mask = np.zeros((len(input_ids), length), dtype=np.int64)
+
+        for i, row in enumerate(input_ids):
+            if tokenizer.padding_side == "left":
+                position = slice(length - len(row), length)
+            else:
+                position = slice(0, len(row))
+
+            ids[i, position] = row
+            mask[i, position] = 1
+            if use_token_types:
+                types[i, position] = token_type_ids[i]
+
+        inputs = {"input_ids": ids, "attention_mask": mask}
+        if use_token_types:
+            inputs["token_type_ids"] = types
+
+        self.inputs = BatchEncoding(inputs, tensor_type="pt")
+
         return self.inputs
 
-    def dataLoader(self, question, texts):
+    def dataLoader(self, question, texts, key=None):
         # TODO might be a better way to do it
+        question = self.tokenize_question(question)
         num_of_texts = len(texts)
         iteration = 0
 
@@ -69,7 +271,7 @@ class QAModel:
             iteration += 1
 
             if texts_for_iteration:
-                data = self.tokenize(question, texts_for_iteration)
+                data = self.tokenize(question, texts_for_iteration, key)
                 yield data
 
             else:
@@ -9,14 +9,11 @@ import asyncio
 import aiohttp
 
 import sys
+import re
+from collections import OrderedDict
 
 from .WikiParser import *
 
-if 'ipykernel' in sys.modules:
-    # workaround ipython notebooks already using async
-    import nest_asyncio
-    nest_asyncio.apply()
-
 
 # class UnOptimized(RuntimeWarning):
 #     pass
@@ -29,41 +26,120 @@ class WikiParser:
     """
     Class that handles parsing from wiki
     """
-    def __init__(self, lang : str ="en"):
+    def __init__(self, lang : str ="en", session : aiohttp.ClientSession = None, executor=None):
         """
         lang: language of wikipedia
         default "en"
         list of all languages can be foun here https://meta.wikimedia.org/wiki/List_of_Wikipedias
+
+        session: aiohttp session used by async methods and aiowiki
+        default: session is created on first use and shared by all requests
+
+        executor: concurrent.futures executor to parse pages in
+        default: None (default executor of the event loop)
         """
         self.headers = {'user-agent': 'my-app/0.0.1'}
-        self.awiki = aiowiki.Wiki.wikipedia(lang)
+        self.lang = lang
+        self.session = session
+        self.session_loop = None
+        self.own_session = session is None
+        self.awiki = None  # created with the session
+        self.executor = executor
+        # url -> revision id of the last downloaded pages
+        self.revisions = OrderedDict()
+        self.max_revisions = 1024
         wiki.set_lang(lang)
     
     def findBestPage(self, question):
         pass
 
     def page(self, name):
-        page = self.awiki.get_page(name)
-        return Page(page, self)
+        return Page(name, self)
 
     def search(self, text):
         return [self.page(i) for i in wiki.search(text)]
 
+    async def asearch(self, text):
+        awiki = await self.getWiki()
+        search = await awiki.opensearch(text)
+        return [Page(i.title, self) for i in search]
+
     def search_summary(self, text):
-        summarys = asyncio.run(self._search_summary(text))
+        summarys = self.run(self.asearch_summary(text))
         return summarys
 
-    async def _search_summary(self, text):
-        pages = await awiki.opensearch(text)
-        summarys = [await i.summary() for i in pages]
-        return summarys
+    async def asearch_summary(self, text):
+        pages = await self.asearch(text)
+        summarys = await asyncio.gather(*[i.asummary() for i in pages])
+        return list(summarys)
 
-    def asearch(self, text):
-        return asyncio.run(self._asearch(text))
+    async def getSession(self):
+        """
+        Returns shared session, creates it if needed
+        """
+        loop = asyncio.get_running_loop()
+        if self.own_session and (
+                self.session is None or self.session.closed or self.session_loop is not loop):
+            # sessions can't be shared between event loops,
+            # the old loop may be closed already, so the old session is dropped
+            # without closing it, close() it on its own loop to avoid that
+            self.session = aiohttp.ClientSession(headers=self.headers)
+            self.session_loop = loop
+            self.awiki = None
+
+        return self.session
+
+    async def getWiki(self):
+        """
+        Returns aiowiki client that uses the shared session
+        """
+        session = await self.getSession()
+        if self.awiki is None:
+            self.awiki = aiowiki.Wiki.wikipedia(self.lang, session=session)
+
+        return self.awiki
 
-    async def _asearch(self, text):
-        search = await self.awiki.opensearch(text)
-        return [Page(i) for i in search]
+    async def close(self):
+        """
+        Closes the session created by the parser
+        must be awaited on the event loop that used it
+        """
+        if self.own_session and self.session and not self.session.closed:
+            await self.session.close()
+
+    def run(self, coroutine):
+        """
+        Runs coroutine from synchronous code
+        Inside a running event loop use async methods instead
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:  # no running loop
+            return asyncio.run(self.closing(coroutine))
+
+        if 'ipykernel' in sys.modules:
+            # workaround ipython notebooks already using async
+            import nest_asyncio
+            nest_asyncio.apply()
+            return asyncio.get_event_loop().run_until_complete(coroutine)
+
+        coroutine.close()
+        raise RuntimeError(
+            "Synchronous methods can't be called inside a running event loop, "
+            "use async methods instead (e.g. await WikiQA.aask(question))")
+
+    async def closing(self, coroutine):
+        """
+        Closes session created for the loop of asyncio.run
+        """
+        try:
+            return await coroutine
+        finally:
+            await self.close()
+
+    async def inExecutor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
 
     def postprocess_text(self, text):
         """
@@ -71,6 +147,36 @@ class WikiParser:
         Python[231] -> Python
         """
         return re.sub(r'\[[^ ]*\]', '', text)
+
+    def getHtml(self, url):
+        """
+        Downloads page and remembers its revision id
+        """
+        response = requests.get(url, headers = self.headers)
+        self.saveRevision(url, response.text)
+        return response.text
+
+    async def agetHtml(self, url):
+        session = await self.getSession()
+        async with session.get(url, headers = self.headers) as response:
+            html = await response.text()
+
+        self.saveRevision(url, html)
+        return html
+
+    def saveRevision(self, url, html):
+        revision = re.search(r'"wgRevisionId":\s*(\d+)', html)
+        if revision:
+            self.revisions[url] = int(revision.group(1))
+            self.revisions.move_to_end(url)
+            if len(self.revisions) > self.max_revisions:
+                self.revisions.popitem(last=False)
+
+    def getRevision(self, url):
+        """
+        Revision id of the page, None if the page was not downloaded yet
+        """
+        return self.revisions.get(url)
         
     def getText(self, url):
         """
@@ -81,8 +187,18 @@ class WikiParser:
             header + text below
             text + list below
         """
-        response = requests.get(url, headers = self.headers)
-        soup = BeautifulSoup(response.text)
+        return self.parseText(self.getHtml(url))
+
+    async def agetText(self, url):
+        html = await self.agetHtml(url)
+        # parsing takes a while, do not block the event loop
+        return await self.inExecutor(self.parseText, html)
+
+    def parseText(self, html):
+        """
+        Gets list of paragraphs from html of page
+        """
+        soup = BeautifulSoup(html)
         div = soup.find('div', class_ = "mw-parser-output").find_all(['p', 'h2', 'h3', 'ul', 'dl'])
         
         div = [i for i in div
@@ -114,8 +230,17 @@ class WikiParser:
         """
         Get infoBox from page
         """
-        response = requests.get(url, headers = self.headers)
-        soup = BeautifulSoup(response.text)
+        return self.parseInfo(self.getHtml(url))
+
+    async def agetInfo(self, url):
+        html = await self.agetHtml(url)
+        return await self.inExecutor(self.parseInfo, html)
+
+    def parseInfo(self, html):
+        """
+        Get infoBox from html of page
+        """
+        soup = BeautifulSoup(html)
 
         tbody = soup.find('tbody')
         
@@ -139,10 +264,10 @@ class WikiParser:
 class Page:
 
     def __init__(self, page, parser=WikiParser()):
-        if isinstance(page, str):
-            page = parser.page(page)
-        self.page = page
-        self.title = page.title
+        # aiowiki pages are bound to a session, so only title is kept
+        if not isinstance(page, str):
+            page = page.title
+        self.title = page
         self.parser = parser
 
         self.page_url = None
@@ -158,32 +283,64 @@ class Page:
 
         return f"<Page {self.title} {self.url()}>"
 
+    async def apage(self):
+        """
+        aiowiki page bound to the current session
+        """
+        awiki = await self.parser.getWiki()
+        return awiki.get_page(self.title)
+
     def url(self):
         if self.page_url:
             return self.page_url
 
-        url = asyncio.run(self._getUrl())
-        return url.view
-    
-    async def _getUrl(self):
-        url = await self.page.urls()
-        return url
+        return self.parser.run(self.aurl())
+
+    async def aurl(self):
+        if not self.page_url:
+            page = await self.apage()
+            url = await page.urls()
+            self.page_url = url.view
+
+        return self.page_url
 
     def text(self):
         url = self.url()
         text = self.parser.getText(url)
         return text
+
+    async def atext(self):
+        url = await self.aurl()
+        text = await self.parser.agetText(url)
+        return text
     
     def infoBox(self):
         url = self.url()
         info = self.parser.getInfo(url)
         return info
 
+    async def ainfoBox(self):
+        url = await self.aurl()
+        info = await self.parser.agetInfo(url)
+        return info
+
     def summary(self):
-        try: summary = self.title + '\n' + asyncio.run(self._getSummary())
-        except: summary = self.title + '\n' + self.text()[0]
-        return summary
-    
+        # run raises inside a running event loop, that is not caught here
+        summary = self.parser.run(self._getSummary())
+        if summary is None: summary = self.text()[0]
+        return self.title + '\n' + summary
+
+    async def asummary(self):
+        summary = await self._getSummary()
+        if summary is None: summary = (await self.atext())[0]
+        return self.title + '\n' + summary
+
     async def _getSummary(self):
-        summary = await self.page.summary()
-        return summary
+        """
+        Summary from wiki api, None if the request fails
+        """
+        try:
+            page = await self.apage()
+            return await page.summary()
+        except Exception:
+            return None
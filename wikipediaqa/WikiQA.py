@@ -1,7 +1,9 @@
 import torch
 import warnings
+import asyncio
 
 from .QAModel import *
+from .CascadeQAModel import *
 from .SentenceModel import *
 from .TextProcessor import *
 from .WikiParser import *
@@ -14,7 +16,12 @@ class WikiQA:
             sentenceModel_name=None,
             lang = "en", 
             batch_size=4, 
-            device=None):
+            device=None,
+            large_model_name=None,
+            top_k=2,
+            threshold=5.0,
+            session=None,
+            executor=None):
 
         """
         model_name: path to model or Hugging Face model name
@@ -30,6 +37,19 @@ class WikiQA:
         lang: language of wikipedia
         list of all languages https://meta.wikimedia.org/wiki/List_of_Wikipedias
         default "en"
+
+        large_model_name: path to model or Hugging Face model name
+        if set, model_name is used as a small fast model for all paragraphs
+        and only top_k best paragraphs are reread by the large model
+        when the best score of the small model is lower than threshold
+        threshold can be calibrated with self.model.calibrate(eval_set)
+        default: None (use only one model)
+
+        session: aiohttp.ClientSession shared by async requests to wikipedia
+        default: created on first use
+
+        executor: concurrent.futures executor to run models in from aask
+        default: None (default executor of the event loop)
         """
 
         if not device:
@@ -42,11 +62,16 @@ class WikiQA:
                 RuntimeWarning)
 
         self.model = QAModel(model_name, model_name, batch_size, device)
+
+        if large_model_name:
+            large_model = QAModel(large_model_name, large_model_name, batch_size, device)
+            self.model = CascadeQAModel(self.model, large_model, top_k, threshold)
         
         self.sentenceModel = SentenceModel(sentenceModel_name, device)
 
-        self.parser = WikiParser()
+        self.parser = WikiParser(session=session, executor=executor)
         self.textProcessor = TextProcessor()
+        self.executor = executor
 
     def __call__(self, question):
         # try:
@@ -73,6 +98,33 @@ class WikiQA:
         #     print(traceback.format_exc())
         #     return 'Something went wrong :('
 
+    async def aask(self, question):
+        """
+        Async version of __call__, models run in executor
+        so the event loop is never blocked
+        """
+        search_requests = await self.inExecutor(self.textProcessor, question)
+
+        answers = await asyncio.gather(
+            *[self._ask(question, search_request) for search_request in search_requests])
+        answers = [answer for i in answers for answer in i]
+
+        if answers:
+            answer = self.best_answer(answers)
+            return self.textProcessor.postprocess_answer(answer)
+
+        return "Can't find answer :("
+
+    async def close(self):
+        """
+        Closes session used by aask
+        """
+        await self.parser.close()
+
+    async def inExecutor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
     def ask(self, question, search_request):
         # print('we search wiki for:', search_request)
         search = self.parser.search(search_request)
@@ -88,16 +140,20 @@ class WikiQA:
 
         # summarys = [i.summary() for i in search if 'may refer to' not in i]
         summarys = []
+        pages = []
         for i in search:
             summary = i.summary()
             # remove pages like this https://en.wikipedia.org/wiki/Python
             if "refer to" not in summary:
                 summarys.append(summary)
+                pages.append(i)
 
+        if len(pages) == 0:  # only disambiguation pages
+            return []
 
         # find the best page via sentenceModel
         best = self.sentenceModel.compare(question, summarys)
-        bestPage = search[best]
+        bestPage = pages[best]
         
         # debug
         # print(f"bestPage {bestPage.title} {bestPage.url()}")
@@ -106,6 +162,28 @@ class WikiQA:
 
         return answers
 
+    async def _ask(self, question, search_request):
+        search = await self.parser.asearch(search_request)
+
+        if len(search) == 0:  # if nothing have been found
+            return [['wiki finds nothing :(', 0]]
+
+        summarys = await asyncio.gather(*[i.asummary() for i in search])
+        # remove pages like this https://en.wikipedia.org/wiki/Python
+        pages = [(page, summary) for page, summary in zip(search, summarys)
+                 if "refer to" not in summary]
+
+        if len(pages) == 0:  # only disambiguation pages
+            return []
+
+        best = await self.inExecutor(
+            self.sentenceModel.compare, question, [summary for page, summary in pages])
+        bestPage = pages[best][0]
+
+        answers = await self._getAnswers(question, bestPage)
+
+        return answers
+
     def askFast(self, question, page, url):
         """
         Process only through summary and infoBox
@@ -120,7 +198,18 @@ class WikiQA:
 
         # tokens = self.tokenize(self.question, texts)
 
-        answers = self.model(question, texts)
+        answers = self.model(question, texts, self.pageKey(url))
+
+        return answers
+
+    async def _askFast(self, question, page, url):
+        info, summary = await asyncio.gather(self.parser.agetInfo(url), page.asummary())
+
+        texts = [info] + [summary]
+
+        texts = [i for i in texts if len(i) != 0]  # remove empty texts
+
+        answers = await self.inExecutor(self.model, question, texts, self.pageKey(url))
 
         return answers
 
@@ -138,10 +227,27 @@ class WikiQA:
 
         texts = [i for i in texts if len(i) > 5]  # remove empty texts
 
-        answers = self.model(question, texts)
+        answers = self.model(question, texts, self.pageKey(url))
 
         return answers
 
+    async def _askSlow(self, question, url):
+        texts = await self.parser.agetText(url)  # get all the text from page
+
+        texts = await self.inExecutor(self.findEnts, question, texts)
+
+        texts = [i for i in texts if len(i) > 5]  # remove empty texts
+
+        answers = await self.inExecutor(self.model, question, texts, self.pageKey(url))
+
+        return answers
+
+    def pageKey(self, url):
+        """
+        Key for caching tokenized paragraphs of page
+        """
+        return (url, self.parser.getRevision(url))
+
     def getAnswers(self, question, page):
         url = page.url()
 
@@ -164,10 +270,33 @@ class WikiQA:
         # print("can't find answer for that")
         return []
 
+    async def _getAnswers(self, question, page):
+        url = await page.aurl()
+
+        answers = await self._askFast(question, page, url)
+
+        good_answers = self.find_good_answers(answers)
+
+        if len(good_answers) > 0:  # if there are good answers
+            return good_answers
+
+        # otherwise ask to look better
+        answers = await self._askSlow(question, url)
+
+        return self.find_good_answers(answers)
+
     def best_answer(self, answers):
-        answers = sorted(answers, key=lambda x: x[1])
+        # scores of different models are not comparable,
+        # answers of the large model of CascadeQAModel come first
+        answers = sorted(answers, key=lambda x: (self.tier(x), x[1]))
         return answers[-1][0]
 
+    def tier(self, answer):
+        """
+        Which model of CascadeQAModel gave the answer, 0 for QAModel
+        """
+        return answer[2] if len(answer) > 2 else 0
+
     def findEnts(self, question, texts):
         """
         Finds paragraphs with entities from the question
@@ -186,16 +315,20 @@ class WikiQA:
 
         return pars
 
-    def find_good_answers(self, answers):
+    def find_good_answers(self, answers, min_score=None):
         """
         removes meaningless answers
+
+        min_score: lowest mean of start and end logits of answer
+        with CascadeQAModel a list of cut-offs for each model (small, large)
+        default: None (no cut-off, same as the old "score > 1" on
+        answer positions, which only removed answers at [CLS])
         """
-        return [[answer, score] for answer, score in answers if
-                        ('[CLS]' not in answer) and
-                        ('[SEP]' not in answer) and
-                        ('<pad>' not in answer) and
-                        ('<unk>' not in answer) and
-                        (len(answer) < 200) and
-                        (len(answer) > 2) and
-                        (answer != '') and
-                        (score > 1)]
+        def good_score(answer):
+            cut_off = min_score
+            if isinstance(cut_off, (list, tuple)):
+                cut_off = cut_off[self.tier(answer)]
+            return cut_off is None or answer[1] > cut_off
+
+        return [answer for answer in answers if
+                        is_answer(answer[0]) and good_score(answer)]
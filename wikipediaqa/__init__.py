@@ -1,5 +1,6 @@
 from .WikiQA import WikiQA
 from .QAModel import QAModel
+from .CascadeQAModel import CascadeQAModel
 from .SentenceModel import SentenceModel
 from .TextProcessor import TextProcessor
 from .WikiParser import WikiParser
\ No newline at end of file